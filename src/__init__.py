@@ -1,3 +1,7 @@
 import lmpcopy
 import lmpoutpost
-import viscpost
\ No newline at end of file
+import viscpost
+import gkpost
+import eqpost
+import surrogate
+import mastercurve
\ No newline at end of file
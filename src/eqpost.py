@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Post-processing of the equilibration runs (lmpscript/equilibration.in)
+and index of the equilibrated systems in data/eq_system
+
+Each equilibration run is expected in its own directory, named (or with a
+restart file named) after the state point, e.g. .../PEC6/373K/0.1MPa/,
+containing the ave/time outputs of equilibration.in:
+    pro.density_one.out   production density
+    final_nvt.out         pressure, etotal, ke, pe of the final NVT run
+"""
+
+import numpy as np
+import pandas as pd
+import os
+import re
+import lmpoutpost as lmp
+
+# restart files: <material>_<nmol>.equi<T>K_<P>MPa, e.g. pec6_125.equi373K_0.1MPa
+RESTART = re.compile(r'^(?P<material>[A-Za-z0-9]+)_(?P<nmol>\d+)'
+                     r'\.equi(?P<temp>\d+(?:\.\d+)?)K_(?P<press>\d+(?:\.\d+)?)MPa$')
+TEMP = re.compile(r'(\d+(?:\.\d+)?)K')
+PRESS = re.compile(r'(\d+(?:\.\d+)?)MPa')
+
+_index = dict()  # cached indexes, by root directory
+
+
+def convergence(data,blocknum=10,nstart=6):
+    """
+    block average of a series and a convergence score
+    The mean is recomputed after discarding up to half of the series
+    (nstart start points, one vectorized pass). The score is the largest
+    deviation of these means from the mean of the second half, in units of
+    the expanded error of the second half; the series is considered
+    converged when score <= 1.
+    return mean and expanded error (95 % confidence interval) of the
+    second half, and the score
+    """
+    data = np.asarray(data,dtype=float)
+    starts = np.linspace(0,len(data)//2,nstart).astype(int)
+    mean,error = lmp.blockGrid(data,starts,[blocknum])
+    mean,error = mean[:,0],error[:,0]
+    score = np.max(np.abs(mean - mean[-1])) / error[-1]
+    return mean[-1],error[-1],score
+
+
+def statepoint(path):
+    """
+    parse temperature [K] and pressure [MPa] from a path
+    """
+    temp = TEMP.findall(path)
+    press = PRESS.findall(path)
+    if not temp or not press:
+        return None,None
+    return float(temp[-1]),float(press[-1])
+
+
+def analyzeeq(directory,blocknum=10):
+    """
+    analyze the outputs of one equilibration run
+    return a dict with mean, expanded error and convergence score of the
+    density, pressure and total energy
+    """
+    result = dict()
+    names = os.listdir(directory)
+    # T and P from the restart file if present, otherwise from the path
+    temp,press = statepoint(directory)
+    for name in names:
+        match = RESTART.match(name)
+        if match:
+            temp,press = float(match['temp']),float(match['press'])
+    result['temp'] = temp
+    result['press'] = press
+
+    if 'pro.density_one.out' in names:
+        df = lmp.loadlmpout(os.path.join(directory,'pro.density_one.out'))
+        mean,error,score = convergence(df.iloc[:,1],blocknum)
+        result.update(density=mean,density_error=error,density_score=score)
+    if 'final_nvt.out' in names:
+        df = lmp.loadlmpout(os.path.join(directory,'final_nvt.out'))
+        for var in ['pressure','etotal']:
+            mean,error,score = convergence(df[var],blocknum)
+            result.update({var: mean,
+                           var+'_error': error,
+                           var+'_score': score})
+    return result
+
+
+def eqbatch(material,root=r"F:\NEMD\data\archive_eq",blocknum=10):
+    """
+    analyze every equilibration run of a material under root (all T x P)
+    a run is a directory that contains pro.density_one.out or final_nvt.out
+    return a DataFrame sorted by temperature and pressure; a state point is
+    converged when all scores are <= 1
+    """
+    rows = []
+    for subdir, dirs, files in os.walk(root):
+        if material.upper() not in subdir.upper():
+            continue
+        if 'pro.density_one.out' in files or 'final_nvt.out' in files:
+            result = analyzeeq(subdir,blocknum)
+            result['material'] = material.upper()
+            result['path'] = subdir
+            rows.append(result)
+    table = pd.DataFrame(rows)
+    if table.empty:
+        print(f"No equilibration run of {material} found in {root}")
+        return table
+    scores = [c for c in table.columns if c.endswith('_score')]
+    table['converged'] = (table[scores] <= 1).all(axis=1)
+    table = table.sort_values(['temp','press']).reset_index(drop=True)
+    ncon = table['converged'].sum()
+    print(f"{ncon} of {len(table)} state points converged")
+    return table
+
+
+def buildindex(root=r"F:\NEMD\data\eq_system",eq=None):
+    """
+    index the equilibrated restart files under root by (material, T, P)
+    eq: optional DataFrame from eqbatch; its converged density and error
+        are attached to the matching entries
+    The index is saved to root/eq_index.csv and cached in memory.
+    """
+    rows = []
+    for subdir, dirs, files in os.walk(root):
+        for file in files:
+            match = RESTART.match(file)
+            if match:
+                rows.append([match['material'].upper(),int(match['nmol']),
+                             float(match['temp']),float(match['press']),
+                             os.path.join(subdir,file)])
+    index = pd.DataFrame(rows,columns=['material','nmol','temp','press','path'])
+    if eq is not None and not eq.empty:
+        cols = ['material','temp','press','density','density_error','converged']
+        index = index.merge(eq[[c for c in cols if c in eq.columns]],
+                            on=['material','temp','press'],how='left')
+    index = index.sort_values(['material','temp','press']).reset_index(drop=True)
+    index.to_csv(os.path.join(root,'eq_index.csv'),index=False)
+    _index[root] = index
+    print(f"{len(index)} equilibrated systems indexed in {root}")
+    return index
+
+
+def loadindex(root=r"F:\NEMD\data\eq_system"):
+    """
+    return the index of root: from memory, from eq_index.csv, or rebuilt
+    """
+    if root not in _index:
+        path = os.path.join(root,'eq_index.csv')
+        if os.path.isfile(path):
+            _index[root] = pd.read_csv(path)
+        else:
+            buildindex(root)
+    return _index[root]
+
+
+def findeq(material,temp,press,root=r"F:\NEMD\data\eq_system"):
+    """
+    path of the equilibrated restart file for a state point, or None
+    temp and press accept 373, '373' or '373K' and 0.1 or '0.1MPa'
+    """
+    index = loadindex(root)
+    temp = float(str(temp).upper().rstrip('K'))
+    press = float(str(press).upper().replace('MPA',''))
+    hit = index[(index['material'] == material.upper())
+                & np.isclose(index['temp'],temp)
+                & np.isclose(index['press'],press)]
+    if hit.empty:
+        print(f"No equilibrated system for {material}, {temp} K, {press} MPa")
+        return None
+    return hit['path'].iloc[0]
@@ -0,0 +1,481 @@
+# -*- coding: utf-8 -*-
+"""
+Green-Kubo (equilibrium) viscosity from the pressure tensor output of LAMMPS
+
+    eta = V/(kB*T) * integral_0^inf <P_ab(0) P_ab(t)> dt
+
+The stress autocorrelation is averaged over the five independent components
+of the symmetric traceless pressure tensor: pxy, pxz, pyz, (pxx-pyy)/2 and
+(pyy-pzz)/2. The expected input is a Ptensor-like file written by
+fix ave/time with columns: step pxx pyy pzz pxy pxz pyz (real units, atm),
+sampled frequently enough to resolve the stress decay (e.g. every 5-10 steps).
+"""
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import os
+from multiprocessing import Pool
+from scipy.fft import next_fast_len, rfft, irfft
+from scipy.optimize import curve_fit
+
+KB = 1.380649e-23   # Boltzmann constant [J/K]
+ATM = 101325        # 1 atm in Pa
+
+
+def stressComponents(ptensor):
+    """
+    convert an (N,6) array of pxx pyy pzz pxy pxz pyz into the (N,5) array of
+    independent shear stresses: pxy, pxz, pyz, (pxx-pyy)/2, (pyy-pzz)/2
+    """
+    p = np.asarray(ptensor,dtype=float)
+    comps = np.empty((len(p),5))
+    comps[:,0:3] = p[:,3:6]
+    comps[:,3] = 0.5*(p[:,0] - p[:,1])
+    comps[:,4] = 0.5*(p[:,1] - p[:,2])
+    return comps
+
+
+class StreamACF:
+    """
+    Autocorrelation of a multi-column series accumulated chunk by chunk.
+
+    Every sample is used as a time origin. The correlation sums are computed
+    with FFTs on blocks of `blocksize` origins, so memory is bounded by
+    ~(blocksize + maxlag) rows regardless of the series length.
+    The mean is removed exactly at the end (no second pass needed).
+    """
+
+    def __init__(self,maxlag,ncol,blocksize=2**16):
+        self.maxlag = maxlag
+        self.ncol = ncol
+        self.blocksize = blocksize
+        self.nfft = next_fast_len(blocksize + maxlag - 1)
+        self.buf = np.empty((0,ncol))
+        self.head = np.empty((0,ncol))  # first maxlag samples
+        self.tail = np.empty((0,ncol))  # last maxlag samples
+        self.sum = np.zeros((maxlag,ncol))  # sum_t x(t)x(t+k)
+        self.total = np.zeros(ncol)
+        self.n = 0
+
+    def update(self,x):
+        x = np.asarray(x,dtype=float).reshape(-1,self.ncol)
+        m = self.maxlag
+        self.n += len(x)
+        self.total += x.sum(axis=0)
+        if len(self.head) < m:
+            self.head = np.concatenate([self.head,x[:m-len(self.head)]])
+        self.tail = np.concatenate([self.tail,x])[-m:]
+        self.buf = np.concatenate([self.buf,x])
+        B = self.blocksize
+        # only correlate origins whose partners up to maxlag are available
+        while len(self.buf) >= B + m - 1:
+            self._correlate(self.buf[:B],self.buf[:B+m-1])
+            self.buf = self.buf[B:]
+
+    def _correlate(self,a,b):
+        fa = rfft(a,n=self.nfft,axis=0)
+        fb = rfft(b,n=self.nfft,axis=0)
+        self.sum += irfft(fa.conj()*fb,n=self.nfft,axis=0)[:self.maxlag]
+
+    def result(self):
+        """
+        return the (maxlag,ncol) autocovariance <dx(0)dx(k)>
+        """
+        B = self.blocksize
+        # remaining origins: partners past the end are simply zero padded
+        while len(self.buf) > 0:
+            self._correlate(self.buf[:B],self.buf[:B+self.maxlag-1])
+            self.buf = self.buf[B:]
+        m = min(self.maxlag,self.n)
+        k = np.arange(m)
+        count = (self.n - k)[:,None]
+        mu = self.total / self.n
+        # sum of x over origins t < n-k and over partners t >= k
+        headsum = np.vstack([np.zeros(self.ncol),np.cumsum(self.head,axis=0)])[:m]
+        tailsum = np.vstack([np.zeros(self.ncol),
+                             np.cumsum(self.tail[::-1],axis=0)])[:m]
+        s_origin = self.total - tailsum
+        s_partner = self.total - headsum
+        cov = self.sum[:m] - mu*(s_origin + s_partner) + count*mu**2
+        return cov / count
+
+
+def countlines(filename,bufsize=2**24):
+    """
+    count the lines of a (possibly very large) text file without parsing it
+    """
+    n = 0
+    with open(filename,'rb') as file:
+        for chunk in iter(lambda: file.read(bufsize),b''):
+            n += chunk.count(b'\n')
+    return n
+
+
+def readPtensor(filename,chunksize=10**6):
+    """
+    read a Ptensor-like LAMMPS ave/time output in chunks
+    yield (step, ptensor) numpy arrays; ptensor has 6 columns
+    """
+    reader = pd.read_csv(filename,
+                         sep=r'\s+',
+                         comment='#',
+                         header=None,
+                         usecols=range(7),
+                         dtype=float,
+                         chunksize=chunksize)
+    for df in reader:
+        data = df.to_numpy()
+        yield data[:,0],data[:,1:7]
+
+
+def gkacf(data,maxlag,nblock=1,chunksize=10**6):
+    """
+    autocorrelation of the 5 independent shear stresses for nblock
+    consecutive blocks of the series
+    data: filename of a Ptensor-like output, or an (N,6) array
+    maxlag: number of lags (in samples)
+    return the acf array of shape (nblock, maxlag, 5)
+    """
+    if isinstance(data,str):
+        nsample = countlines(data) - 2   # two header lines
+        chunks = readPtensor(data,chunksize)
+    else:
+        data = np.asarray(data,dtype=float)
+        if data.shape[1] == 7:
+            # step column included
+            data = data[:,1:]
+        nsample = len(data)
+        chunks = ((None,data[i:i+chunksize])
+                  for i in range(0,nsample,chunksize))
+
+    blocklen = nsample // nblock
+    if blocklen < maxlag:
+        raise ValueError("Blocks ({} samples) shorter than maxlag ({})"
+                         .format(blocklen,maxlag))
+    acfs = np.zeros((nblock,maxlag,5))
+    iblock = 0
+    acc = StreamACF(maxlag,5)
+    for step,p in chunks:
+        x = stressComponents(p)
+        while len(x) > 0 and iblock < nblock:
+            take = blocklen - acc.n
+            acc.update(x[:take])
+            x = x[take:]
+            if acc.n == blocklen:
+                acfs[iblock] = acc.result()
+                iblock += 1
+                acc = StreamACF(maxlag,5)
+
+    return acfs
+
+
+def runningIntegral(acf,dtau):
+    """
+    cumulative trapezoidal integral of acf along the lag axis (axis=-2)
+    """
+    acf = np.asarray(acf)
+    out = np.zeros_like(acf)
+    out[...,1:,:] = np.cumsum(0.5*(acf[...,1:,:] + acf[...,:-1,:]),axis=-2)*dtau
+    return out
+
+
+def plateau(tau,integrals,tcut=None,tol=0.4):
+    """
+    estimate the plateau of the running GK integrals of independent blocks
+    tau: lag time
+    integrals: (nblock, ntau) running integrals
+    tcut: end of the plateau window. If None, it is taken as the first time
+          the block standard deviation exceeds tol * |mean|
+    The plateau is the average over [tcut/2, tcut]
+    return mean, expanded error (95 % confidence interval), tcut
+    """
+    integrals = np.atleast_2d(integrals)
+    nblock = len(integrals)
+    mean = integrals.mean(axis=0)
+    if tcut is None:
+        if nblock > 1:
+            sd = integrals.std(axis=0,ddof=1)
+            noisy = np.nonzero((sd > tol*np.abs(mean)) & (tau > 0))[0]
+            icut = noisy[0] if len(noisy) else len(tau) - 1
+        else:
+            icut = len(tau) - 1
+        tcut = tau[icut]
+    window = (tau >= tcut/2) & (tau <= tcut)
+    values = integrals[:,window].mean(axis=1)
+    eta = values.mean()
+    if nblock > 1:
+        error = 2 * values.std(ddof=1)/np.sqrt(nblock)
+    else:
+        error = np.nan
+    return eta,error,tcut
+
+
+def gkfactor(temp,vol):
+    """
+    V/(kB*T) prefactor that converts an integral in atm^2*ps to mPa s
+    temp: temperature [K]
+    vol: volume [A^3]
+    """
+    return float(vol)*1e-30/(KB*float(temp))*ATM**2*1e-12*1e3
+
+
+def sampleinterval(data,dt=0.5):
+    """
+    time between two samples [ps] of a Ptensor-like file or (N,7) array
+    dt: timestep in fs
+    """
+    if isinstance(data,str):
+        with open(data) as file:
+            file.readline()
+            file.readline()
+            s0 = float(file.readline().split()[0])
+            s1 = float(file.readline().split()[0])
+    else:
+        data = np.asarray(data)
+        if data.shape[1] != 7:
+            raise ValueError("Array without a step column: "
+                             "the sampling interval dtau must be given")
+        s0,s1 = data[0,0],data[1,0]
+    return (s1 - s0)*dt*1e-3
+
+
+class GKdata:
+
+    def __init__(self,material,temp,press,vol,tau,acf,dt=0.5):
+        self.material = material
+        self.temp = temp # temperature [K]
+        self.press = press # pressure [MPa]
+        self.vol = vol # volume [A^3]
+        self.dt = dt # timestep in fs
+        self.tau = tau # lag time [ps]
+        self.acf = acf # (nblock, ntau, 5) stress autocovariance [atm^2]
+        # running integral averaged over the 5 components, per block
+        self.integrals = gkfactor(temp,vol)*runningIntegral(acf,tau[1]-tau[0]).mean(axis=-1)
+        self.eta,self.error,self.tcut = plateau(tau,self.integrals)
+
+    def info(self,ifprint=True):
+        s = '{}, {}, {}, GK'.format(self.material,self.temp,self.press)
+        if ifprint:
+            print(s)
+        return s
+
+    def average(self,tcut=None,ifprint=False):
+        """
+        plateau value of the running integral and its expanded error
+        (95 % confidence interval) from the spread over blocks
+        tcut [ps]: end of the plateau window; automatic if None
+        """
+        self.eta,self.error,self.tcut = plateau(self.tau,self.integrals,tcut)
+        if ifprint:
+            print("Plateau window: {:.1f} to {:.1f} ps".format(self.tcut/2,
+                                                               self.tcut))
+            print("Viscosity: {:.2f} +- {:.2f} mPa s".format(self.eta,
+                                                             self.error))
+        return self.eta,self.error
+
+    def plot(self):
+        title = f'Green-Kubo viscosity of {self.material} for {self.temp}, {self.press}'
+        fig, ax = plt.subplots(2,1,sharex=True,constrained_layout=True)
+        fig.suptitle(title)
+        acf = self.acf.mean(axis=(0,2))
+        ax[0].plot(self.tau,acf/acf[0])
+        ax[0].set_xscale('log')
+        ax[0].set_ylabel('normalized stress ACF')
+
+        mean = self.integrals.mean(axis=0)
+        ax[1].plot(self.tau,self.integrals.T,c='grey',lw=0.5)
+        ax[1].plot(self.tau,mean,c='r',label='block average')
+        ax[1].axhline(self.eta,ls='--',c='b',
+                      label='{:.2f} +- {:.2f} mPa s'.format(self.eta,self.error))
+        ax[1].axvspan(self.tcut/2,self.tcut,color='b',alpha=0.1)
+        ax[1].set_xlabel('lag time [ps]')
+        ax[1].set_ylabel('viscosity [mPa s]')
+        ax[1].legend()
+        plt.show()
+
+        return fig,ax
+
+
+def greenkubo(filename,temp,vol,press=None,material=None,
+              dt=0.5,maxlag=10.0,nblock=10,chunksize=10**6,dtau=None):
+    """
+    Green-Kubo viscosity from a Ptensor-like file or an (N,7) array
+    temp: temperature [K]
+    vol: volume of the simulation box [A^3]
+    dt: timestep in fs
+    maxlag: longest correlation time [ps]
+    nblock: number of blocks used to estimate the uncertainty
+    dtau: sampling interval [ps]; required for an (N,6) array without
+          the step column, read from the steps otherwise
+    return a GKdata instance
+    """
+    if dtau is None:
+        dtau = sampleinterval(filename,dt)
+    nlag = int(round(maxlag/dtau)) + 1
+    acf = gkacf(filename,nlag,nblock,chunksize)
+    tau = np.arange(nlag)*dtau
+    gk = GKdata(material,temp,press,vol,tau,acf,dt=dt)
+    print("Green-Kubo viscosity: {:.2f} +- {:.2f} mPa s".format(gk.eta,gk.error))
+    return gk
+
+
+# ------------------------------------------------------------------------------
+#                  Time-decomposition method (independent replicas)
+# ------------------------------------------------------------------------------
+
+def doubleExp(t, A, alpha, tau1, tau2):
+    """
+    double-exponential model of the running GK integral
+    eta(inf) = A*(alpha*tau1 + (1-alpha)*tau2)
+    """
+    return A*alpha*tau1*(1-np.exp(-t/tau1)) + A*(1-alpha)*tau2*(1-np.exp(-t/tau2))
+
+
+def replicaIntegral(filename,temp,vol,nlag,dt=0.5,chunksize=10**6):
+    """
+    running GK integral [mPa s] of a single replica (whole series, 1 block)
+    return the integral and the sampling interval [ps] of the file
+    """
+    dtau = sampleinterval(filename,dt)
+    acf = gkacf(filename,nlag,nblock=1,chunksize=chunksize)[0]
+    return gkfactor(temp,vol)*runningIntegral(acf,dtau).mean(axis=-1), dtau
+
+
+def _replicaTask(args):
+    # top-level so that it can be sent to a process pool
+    return replicaIntegral(*args)
+
+
+class TDdata:
+
+    def __init__(self,material,temp,press,tau,mean,std,nrep):
+        self.material = material
+        self.temp = temp # temperature [K]
+        self.press = press # pressure [MPa]
+        self.tau = tau # lag time [ps]
+        self.mean = mean # replica-averaged running integral [mPa s]
+        self.std = std # standard deviation over replicas [mPa s]
+        self.nrep = nrep # number of replicas
+        self.fit()
+
+    def info(self,ifprint=True):
+        s = '{}, {}, {}, GK-TD ({} replicas)'.format(self.material,self.temp,
+                                                     self.press,self.nrep)
+        if ifprint:
+            print(s)
+        return s
+
+    def fit(self,tol=0.4):
+        """
+        fit sigma(t) = a*t^b, then fit the double exponential to the averaged
+        running integral up to tcut, weighted by 1/t^b
+        tcut is the first time where std > tol * mean
+        """
+        t = self.tau[1:]
+        m = self.mean[1:]
+        s = self.std[1:]
+        noisy = np.nonzero(s > tol*np.abs(m))[0]
+        icut = noisy[0] if len(noisy) else len(t) - 1
+        icut = min(max(icut,8),len(t) - 1)
+        self.tcut = t[icut]
+        t, m, s = t[:icut+1], m[:icut+1], s[:icut+1]
+
+        # power-law fit of the std in log space
+        good = s > 0
+        b, loga = np.polyfit(np.log(t[good]),np.log(s[good]),1)
+        self.b = b
+        # standard error of the replica mean, from the smooth sigma(t)
+        sigma = np.exp(loga)*t**b/np.sqrt(self.nrep)
+
+        eta0 = m[-1]
+        p0 = [eta0/(0.5*(0.01+0.2)*self.tcut),0.5,0.01*self.tcut,0.2*self.tcut]
+        try:
+            popt, pcov = curve_fit(doubleExp,t,m,p0=p0,sigma=sigma,
+                                   absolute_sigma=True,
+                                   bounds=([0,0,0,0],[np.inf,1,np.inf,np.inf]),
+                                   method='trf')
+        except (RuntimeError,ValueError,TypeError) as e:
+            # keep the replica statistics; refit with another tol
+            print(f"Warning: double-exponential fit failed ({e})")
+            self.popt = np.full(4,np.nan)
+            self.eta, self.error = np.nan, np.nan
+            return self.eta,self.error
+        A, alpha, tau1, tau2 = popt
+        self.popt = popt
+        self.eta = A*(alpha*tau1 + (1-alpha)*tau2)
+        # propagate the parameter covariance to eta(inf)
+        jac = np.array([alpha*tau1 + (1-alpha)*tau2,
+                        A*(tau1 - tau2),
+                        A*alpha,
+                        A*(1-alpha)])
+        self.error = 2 * np.sqrt(jac @ pcov @ jac)
+        return self.eta,self.error
+
+    def plot(self):
+        title = f'Time decomposition of {self.material} for {self.temp}, {self.press}'
+        fig, ax = plt.subplots(2,1,sharex=True,constrained_layout=True)
+        fig.suptitle(title + f'\n {self.nrep} replicas')
+        ax[0].plot(self.tau,self.mean,c='k',label='replica average')
+        ax[0].fill_between(self.tau,self.mean-self.std,self.mean+self.std,
+                           color='grey',alpha=0.3)
+        ax[0].plot(self.tau,doubleExp(self.tau,*self.popt),c='r',
+                   label='double exponential fit')
+        ax[0].axhline(self.eta,ls='--',c='b',
+                      label='{:.2f} +- {:.2f} mPa s'.format(self.eta,self.error))
+        ax[0].axvline(self.tcut,ls=':',c='b')
+        ax[0].set_ylabel('viscosity [mPa s]')
+        ax[0].legend()
+        ax[1].loglog(self.tau[1:],self.std[1:],c='orange')
+        ax[1].set_xlabel('lag time [ps]')
+        ax[1].set_ylabel('std over replicas')
+        plt.show()
+
+        return fig,ax
+
+
+def timedecomposition(directory,temp,vol,press=None,material=None,
+                      keyword='Ptensor',dt=0.5,maxlag=100.0,
+                      nproc=None,chunksize=10**6):
+    """
+    Green-Kubo viscosity by the time-decomposition method
+    (Zhang, Otani & Maginn, JCTC 2015)
+    directory: folder containing one Ptensor-like file per independent replica
+    keyword: only files containing it are used
+    maxlag: longest correlation time [ps]
+    nproc: number of worker processes (all cores if None)
+    Each replica is loaded and transformed in a process pool; the mean and
+    std over replicas are accumulated as results arrive (Welford), so only
+    one running integral per replica is ever held in memory.
+    return a TDdata instance
+    """
+    files = []
+    for root, subdirs, names in os.walk(directory):
+        for name in names:
+            if keyword in name:
+                files.append(os.path.join(root,name))
+    files.sort()
+    if len(files) < 2:
+        raise ValueError(f"Need at least 2 replicas, found {len(files)} in {directory}")
+    print("Number of replicas: {}".format(len(files)))
+
+    dtau = sampleinterval(files[0],dt)
+    nlag = int(round(maxlag/dtau)) + 1
+    tasks = [(f,temp,vol,nlag,dt,chunksize) for f in files]
+
+    n = 0
+    mean = np.zeros(nlag)
+    m2 = np.zeros(nlag)
+    with Pool(nproc) as pool:
+        for integral, interval in pool.imap_unordered(_replicaTask,tasks):
+            if not np.isclose(interval,dtau):
+                raise ValueError("Replicas have different sampling intervals")
+            n += 1
+            delta = integral - mean
+            mean += delta / n
+            m2 += delta * (integral - mean)
+    std = np.sqrt(m2/(n-1))
+    tau = np.arange(nlag)*dtau
+    td = TDdata(material,temp,press,tau,mean,std,n)
+    print("Time-decomposition viscosity: {:.2f} +- {:.2f} mPa s".format(td.eta,td.error))
+    return td
@@ -9,9 +9,14 @@ ALL RIGHTS RESERVED
 """
 
 import matplotlib.pyplot as plt
+import io
+import itertools
 import math
+import os
 import numpy as np
 import pandas as pd
+from multiprocessing import Pool
+from multiprocessing import resource_tracker, shared_memory
 
 from statsmodels.graphics import tsaplots
 
@@ -47,6 +52,197 @@ def loadlmpout(filename):
     return df
 
 
+class SharedBuffer:
+    """
+    owner of a shared-memory block, exposed through the array interface
+
+    Arrays made from it (np.asarray) and all their views have this object
+    at the end of their base chain, so the block stays mapped as long as
+    any of them is alive and is closed only when the last one is gone.
+    """
+
+    def __init__(self,shm,shape,dtype=float):
+        self.shm = shm
+        dtype = np.dtype(dtype)
+        # address of the mapping; the temporary array holds no export
+        address = np.frombuffer(shm.buf,dtype=np.uint8).__array_interface__['data'][0]
+        self.__array_interface__ = {'shape': tuple(shape),
+                                    'typestr': dtype.str,
+                                    'data': (address,False),
+                                    'version': 3}
+
+
+def _byteranges(filename,offset,nrange):
+    """
+    split [offset, end of file) into nrange newline-aligned byte ranges
+    """
+    size = os.path.getsize(filename)
+    bounds = [offset]
+    with open(filename,'rb') as file:
+        for i in range(1,nrange):
+            pos = offset + (size - offset)*i//nrange
+            if pos <= bounds[-1]:
+                continue
+            file.seek(pos)
+            file.readline()   # move to the start of the next line
+            pos = file.tell()
+            if pos >= size:
+                break
+            if pos > bounds[-1]:
+                bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds[:-1],bounds[1:]))
+
+
+def _readrange(filename,start,end):
+    with open(filename,'rb') as file:
+        file.seek(start)
+        return file.read(end - start)
+
+
+def _countrange(args):
+    filename,start,end = args
+    buf = _readrange(filename,start,end)
+    n = buf.count(b'\n')
+    if buf and not buf.endswith(b'\n'):
+        n += 1
+    return n
+
+
+def _parserange(filename,start,end,ncol,usecols):
+    buf = _readrange(filename,start,end)
+    df = pd.read_csv(io.BytesIO(buf),sep=r'\s+',header=None,
+                     usecols=usecols,dtype=float)
+    if usecols is not None:
+        # keep the requested column order
+        df = df[list(usecols)]
+    return df.to_numpy().reshape(-1,ncol)
+
+
+def _fillTask(args):
+    # parse a byte range and write it into the shared array
+    filename,start,end,row0,nrows,ncol,usecols,name = args
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        out = np.ndarray((nrows,ncol),dtype=float,buffer=shm.buf)
+        data = _parserange(filename,start,end,ncol,usecols)
+        out[row0:row0+len(data)] = data
+        del out
+    finally:
+        shm.close()
+
+
+def _blockTask(args):
+    # parse a byte range and reduce it to per-block sums
+    filename,start,end,row0,ncol,usecols,blocksize = args
+    data = _parserange(filename,start,end,ncol,usecols)
+    block = (row0 + np.arange(len(data))) // blocksize
+    first = block[0] if len(block) else 0
+    sums = np.zeros((block[-1] - first + 1 if len(block) else 0,ncol))
+    np.add.at(sums,block - first,data)
+    return first,sums
+
+
+def parload(filename,usecols=None,blocksize=None,nproc=None,chunkbytes=2**26):
+    """
+        load a (very large) LAMMPS ave/time output with a process pool
+
+        The file is split into newline-aligned byte ranges that are parsed
+        concurrently. Without blocksize, every worker writes its rows
+        directly into one shared-memory array, which is returned as is
+        (no copy). With blocksize, each worker only returns the sums of the
+        blocks it covers, and the block means are returned.
+        usecols: indices of the columns to keep (all if None)
+        blocksize: number of rows per block for the block-mean reduction
+        return the numpy array and the column names
+    """
+    # read 2nd line of the LAMMPS file as header
+    with open(filename) as file:
+        file.readline()
+        header = file.readline()
+        offset = file.tell()
+    names = [s[2:] if s.startswith('v_') else s
+             for s in header.rstrip().strip('#').split()]
+    if usecols is not None:
+        names = [names[i] for i in usecols]
+    ncol = len(names)
+
+    nproc = nproc or os.cpu_count()
+    size = os.path.getsize(filename)
+    nrange = max(nproc,math.ceil((size - offset)/chunkbytes))
+    ranges = _byteranges(filename,offset,nrange)
+
+    # start the tracker before the workers, so that they share it and do
+    # not unlink the shared memory when they exit (POSIX only; on Windows
+    # the block is freed when its last handle is closed)
+    if os.name == 'posix':
+        resource_tracker.ensure_running()
+    with Pool(nproc) as pool:
+        counts = pool.map(_countrange,[(filename,a,b) for a,b in ranges])
+        row0 = np.concatenate([[0],np.cumsum(counts)])
+        nrows = int(row0[-1])
+
+        if blocksize is not None:
+            nblock = nrows // blocksize   # incomplete last block is dropped
+            sums = np.zeros((nblock + 1,ncol))
+            tasks = [(filename,a,b,int(r),ncol,usecols,blocksize)
+                     for (a,b),r in zip(ranges,row0)]
+            for first,part in pool.imap_unordered(_blockTask,tasks):
+                sums[first:first+len(part)] += part
+            return sums[:nblock]/blocksize, names
+
+        shm = shared_memory.SharedMemory(create=True,
+                                         size=max(nrows*ncol*8,1))
+        tasks = [(filename,a,b,int(r),nrows,ncol,usecols,shm.name)
+                 for (a,b),r in zip(ranges,row0)]
+        pool.map(_fillTask,tasks)
+
+    # drop the name: the memory is freed once the last mapping is closed
+    shm.unlink()
+    # the array (and every view of it) keeps the mapping alive
+    data = np.asarray(SharedBuffer(shm,(nrows,ncol)))
+    return data, names
+
+
+def loadchunk(filename,batch=1000):
+    """
+        load a LAMMPS ave/chunk output file (fixed number of chunks)
+        The file is read in batches of frames, each parsed in one go.
+        return steps (nframe,), data (nframe, nchunk, nfield) and the
+        field names, e.g. ['Chunk', 'Coord1', 'Ncount', 'vx']
+    """
+    with open(filename) as file:
+        file.readline()
+        file.readline()
+        header = file.readline()
+        names = header.rstrip().strip('#').split()
+        steps = []
+        frames = []
+        line = file.readline()
+        if not line:
+            return np.empty(0), np.empty((0,0,len(names))), names
+        nchunk = int(line.split()[1])
+        nfield = len(names)
+        # a frame is 1 line "step nchunk total" + nchunk lines of nfield
+        framelen = 3 + nchunk*nfield
+        pending = [line]
+        while True:
+            lines = list(itertools.islice(file,batch*(nchunk+1) - len(pending)))
+            lines = pending + lines
+            pending = []
+            if not lines:
+                break
+            values = np.array(' '.join(lines).split(),dtype=float)
+            nframe = len(values) // framelen
+            values = values[:nframe*framelen].reshape(nframe,framelen)
+            steps.append(values[:,0])
+            frames.append(values[:,3:].reshape(nframe,nchunk,nfield))
+            if len(lines) < batch*(nchunk+1):
+                break
+
+    return np.concatenate(steps), np.concatenate(frames), names
+
+
 def plot1(data,dt=0.5,title=None,window=100,sharex=True):
     """
     plot a single varial against time
@@ -208,6 +404,92 @@ def blockAverage(data,b,style='blocknum',ifprint=True):
     return blockMean,blockEE
 
 
+def blockAverage2d(data,b,style='blocknum'):
+    """
+    block average of every column of a 2-D array (or DataFrame) at once
+    return the block means (Nblock, ncol), the overall means (ncol,) and
+    the covariance matrix of the means (ncol, ncol), i.e. the block
+    covariance divided by Nblock; the errors of any linear combination
+    c of the columns follow as 2*sqrt(c @ cov @ c)
+    """
+    data = np.asarray(data,dtype=float)
+    if data.ndim == 1:
+        data = data[:,None]
+    N = len(data)     # total number of observations in data
+    if style == 'blocksize':
+        blockSize = b
+        Nblock = int(N/blockSize) # total number of such blocks in data
+    elif style == 'blocknum':
+        Nblock = b
+        blockSize = int(N/Nblock)
+
+    blocks = data[:Nblock*blockSize].reshape(Nblock,blockSize,-1)
+    blockAverages = blocks.mean(axis=1)
+    blockMean = blockAverages.mean(axis=0)
+    blockCov = np.cov(blockAverages,rowvar=False,ddof=1).reshape(
+        data.shape[1],data.shape[1]) / Nblock
+    return blockAverages,blockMean,blockCov
+
+
+def tensorAverage(data,blocknum=10):
+    """
+    block average of a full pressure-tensor output (Ptensor.out):
+    columns step, pxx, pyy, pzz, pxy, pxz, pyz in pressure units [atm]
+    (KEtensor.out is a kinetic-energy tensor in energy units, and
+    virial.out lacks the kinetic term, so neither applies)
+    Derived quantities, with covariance-aware errors, in MPa:
+        N1 = sxx - syy = pyy - pxx   first normal-stress difference
+        N2 = syy - szz = pzz - pyy   second normal-stress difference
+        pressure = (pxx + pyy + pzz)/3
+    return a DataFrame indexed by quantity with mean and error
+    (expanded error, 95 % confidence interval)
+    """
+    data = np.asarray(data,dtype=float)[:,1:7] * 0.101325  # atm -> MPa
+    names = ['pxx','pyy','pzz','pxy','pxz','pyz']
+    blockAverages,blockMean,blockCov = blockAverage2d(data,blocknum)
+    # each row: coefficients of the linear combination of the 6 columns
+    coef = np.vstack([np.eye(6),
+                      [-1,1,0,0,0,0],
+                      [0,-1,1,0,0,0],
+                      [1/3,1/3,1/3,0,0,0]])
+    mean = coef @ blockMean
+    error = 2*np.sqrt(np.einsum('ij,jk,ik->i',coef,blockCov,coef))
+    return pd.DataFrame({'mean': mean,'error': error},
+                        index=names + ['N1','N2','pressure'])
+
+
+def blockGrid(data,starts,blocknums):
+    """
+    block average of data[s:] for every start index s in starts and every
+    number of blocks b in blocknums, in one vectorized pass over prefix sums
+    Blocks are chopped from s as in blockAverage (the remainder at the end
+    is dropped).
+    return mean and expanded error (95 % confidence interval), both arrays
+    of shape (len(starts), len(blocknums))
+    """
+    data = np.asarray(data,dtype=float)
+    starts = np.asarray(starts,dtype=int)[:,None,None]
+    blocknums = np.asarray(blocknums,dtype=int)[None,:,None]
+    N = len(data)
+    csum = np.concatenate([[0.0],np.cumsum(data)])
+
+    blockSize = (N - starts) // blocknums        # (ns, nb, 1)
+    i = np.arange(blocknums.max())[None,None,:]  # block index
+    valid = i < blocknums
+    ibeg = np.where(valid,starts + i*blockSize,0)
+    iend = np.where(valid,ibeg + blockSize,0)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        blockAverages = (csum[iend] - csum[ibeg]) / blockSize
+    blockAverages = np.where(valid,blockAverages,0.0)
+
+    nb = blocknums[...,0]
+    blockMean = blockAverages.sum(axis=-1) / nb
+    dev = np.where(valid,blockAverages - blockMean[...,None],0.0)
+    blockSE = np.sqrt((dev**2).sum(axis=-1)/(nb - 1)/nb)
+    blockEE = blockSE * 2  # extended error (95 % confidence interval)
+    return blockMean,blockEE
+
+
 def blockSizing(data, isplot=True, maxBlockSize=0):
 
     # data should be a list or 1d numpy array or pandas series
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Time-temperature(-pressure) superposition of NEMD viscosity curves
+
+All state points are shifted at once in log space onto a common master
+curve, log10(eta/b) = g(log10(a*srate)), where g is a cubic B-spline fitted
+together with the shift factors. The residuals and their Jacobian are
+vectorized over all points, so hundreds of state points take seconds.
+The horizontal shifts can then be fitted to the WLF or Arrhenius law.
+"""
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from scipy.interpolate import BSpline
+from scipy.optimize import curve_fit, least_squares
+
+R = 8.314462618 # gas constant [J/mol/K]
+
+
+def WLF(T, C1, C2, Tr):
+    """
+    T: temperature [K]
+    C1, C2: WLF constants
+    Tr: reference temperature (held fixed)
+    return log10 of the shift factor
+    """
+    return -C1*(T - Tr)/(C2 + T - Tr)
+
+
+def Arrhenius(T, Ea, Tr):
+    """
+    T: temperature [K]
+    Ea: activation energy [J/mol]
+    Tr: reference temperature (held fixed)
+    return log10 of the shift factor
+    """
+    return Ea/(R*np.log(10))*(1/T - 1/Tr)
+
+
+class MasterCurve:
+
+    def __init__(self,batches,ref=0,vertical='coupled',nknots=6):
+        """
+        batches: list of ViscBatch
+        ref: index of the reference state point (zero shift)
+        vertical: 'coupled' (b = a, i.e. eta/a vs a*srate),
+                  'free' (independent vertical shifts) or 'none' (b = 1)
+        nknots: number of interior knots of the master-curve spline
+        """
+        self.material = batches[0].material
+        self.ref = ref
+        self.vertical = vertical
+        self.nknots = nknots
+        self.temp = np.array([float(str(b.temp).upper().rstrip('K'))
+                              for b in batches])
+        self.press = np.array([float(str(b.press).upper().replace('MPA',''))
+                               for b in batches])
+        # flatten all points; idx maps each point to its state point
+        x, y, s, idx = [], [], [], []
+        for i,b in enumerate(batches):
+            res = b.results
+            eta = res['viscosity'].to_numpy(dtype=float)
+            x.append(np.log10(res['srate'].to_numpy(dtype=float)))
+            y.append(np.log10(eta))
+            # standard error of log10(eta), from the expanded error
+            s.append(res['error'].to_numpy(dtype=float)/2/eta/np.log(10))
+            idx.append(np.full(len(res),i))
+        self.x, self.y = np.concatenate(x), np.concatenate(y)
+        self.s, self.idx = np.concatenate(s), np.concatenate(idx)
+        self.n = len(batches)
+        self.fit()
+
+    def _unpack(self,p):
+        # p = [free horizontal shifts, (free vertical shifts), coefficients]
+        n = self.n - 1
+        free = np.arange(self.n) != self.ref
+        h = np.zeros(self.n)
+        h[free] = p[:n]
+        v = np.zeros(self.n)
+        if self.vertical == 'free':
+            v[free] = p[n:2*n]
+            c = p[2*n:]
+        else:
+            c = p[n:]
+            if self.vertical == 'coupled':
+                v = h
+        return h,v,c
+
+    def _basis(self,X):
+        return BSpline.design_matrix(X,self.knots,3,extrapolate=True).toarray()
+
+    def _spline(self,c):
+        return BSpline(self.knots,c,3,extrapolate=True)
+
+    def _residuals(self,p):
+        h,v,c = self._unpack(p)
+        X = self.x + h[self.idx]
+        return (self.y - v[self.idx] - self._spline(c)(X))/self.s
+
+    def _jacobian(self,p):
+        h,v,c = self._unpack(p)
+        X = self.x + h[self.idx]
+        dg = self._spline(c).derivative()(X)
+        # one-hot map of points to state points, without the reference
+        onehot = (self.idx[:,None] == np.arange(self.n)[None,:])
+        onehot = np.delete(onehot,self.ref,axis=1).astype(float)
+        dh = -dg[:,None]*onehot
+        if self.vertical == 'coupled':
+            dh = dh - onehot
+        blocks = [dh]
+        if self.vertical == 'free':
+            blocks.append(-onehot)
+        blocks.append(-self._basis(X))
+        return np.hstack(blocks)/self.s[:,None]
+
+    def fit(self):
+        """
+        optimize shifts and master curve jointly (weighted least squares)
+        """
+        # initial shifts from the low-rate (Newtonian) viscosities, b = a
+        eta0 = np.array([self.y[self.idx == i][np.argmin(self.x[self.idx == i])]
+                         for i in range(self.n)])
+        h0 = eta0 - eta0[self.ref]
+        free = np.arange(self.n) != self.ref
+        if self.vertical == 'none':
+            h0 = np.zeros(self.n)
+        X = self.x + h0[self.idx]
+        # knots over the initial reduced-rate range, padded by half a decade
+        self.xlim = (X.min() - 0.5, X.max() + 0.5)
+        interior = np.linspace(*self.xlim,self.nknots + 2)[1:-1]
+        self.knots = np.concatenate([[self.xlim[0]]*4,interior,
+                                     [self.xlim[1]]*4])
+        p0 = [h0[free]]
+        if self.vertical == 'free':
+            p0.append(h0[free])
+        V = self._basis(X)/self.s[:,None]
+        c0 = np.linalg.lstsq(V,(self.y - h0[self.idx])/self.s,rcond=None)[0]
+        p0.append(c0)
+        res = least_squares(self._residuals,np.concatenate(p0),
+                            jac=self._jacobian,method='trf',
+                            x_scale='jac')
+        self.p = res.x
+        J = res.jac
+        self.cov = np.linalg.pinv(J.T @ J)
+        self.chi2 = np.sum(res.fun**2)
+        self.h, self.v, self.coef = self._unpack(res.x)
+
+        # expanded errors (95 % confidence interval) of the shifts
+        perr = 2*np.sqrt(np.diag(self.cov))
+        n = self.n - 1
+        herr = np.zeros(self.n)
+        herr[free] = perr[:n]
+        verr = np.zeros(self.n)
+        if self.vertical == 'free':
+            verr[free] = perr[n:2*n]
+        elif self.vertical == 'coupled':
+            verr = herr
+        self.shifts = pd.DataFrame({'temp': self.temp,
+                                    'press': self.press,
+                                    'log_a': self.h,
+                                    'log_a error': herr,
+                                    'log_b': self.v,
+                                    'log_b error': verr})
+        return self.shifts
+
+    def curve(self,x=None):
+        """
+        master curve and its expanded error at reduced rates x = log10(a*srate)
+        return x, log10(eta/b), error in log10(eta/b)
+        """
+        if x is None:
+            X = self.x + self.h[self.idx]
+            x = np.linspace(X.min(),X.max(),100)
+        V = self._basis(x)
+        ncoef = len(self.coef)
+        cov = self.cov[-ncoef:,-ncoef:]
+        error = 2*np.sqrt(np.einsum('ij,jk,ik->i',V,cov,V))
+        return x, V @ self.coef, error
+
+    def lawfit(self,law=Arrhenius,press=None):
+        """
+        fit the horizontal shifts at one pressure to WLF or Arrhenius
+        press: pressure [MPa]; that of the reference state if None
+        Off the reference isobar the shifts include the pressure shift and
+        are not zero at Tr, so a free offset log_a(Tr) is fitted as well.
+        return parameters and their expanded errors as dicts
+        """
+        if press is None:
+            press = self.press[self.ref]
+        sel = np.isclose(self.press,press)
+        T = self.temp[sel]
+        loga = self.h[sel]
+        sigma = np.maximum(self.shifts['log_a error'].to_numpy()[sel]/2,1e-6)
+        Tr = self.temp[self.ref]
+        offset = not np.isclose(press,self.press[self.ref])
+        if law is WLF:
+            f = lambda T, C1, C2, c=0: WLF(T,C1,C2,Tr) + c
+            p0, names = [10,100], ['C1','C2']
+        else:
+            f = lambda T, Ea, c=0: Arrhenius(T,Ea,Tr) + c
+            p0, names = [50e3], ['Ea']
+        if offset:
+            p0, names = p0 + [0], names + ['offset']
+        popt, pcov = curve_fit(f,T,loga,p0=p0,sigma=sigma,absolute_sigma=True)
+        perr = 2*np.sqrt(np.diag(pcov))
+        print(f"{law.__name__} fit at {press} MPa, Tr = {Tr} K:")
+        for name,value,error in zip(names,popt,perr):
+            print(f"{name}: {value:.4g} +- {error:.2g}")
+        return dict(zip(names,popt)),dict(zip(names,perr))
+
+    def plot(self):
+        fig, ax = plt.subplots(constrained_layout=True)
+        X = self.x + self.h[self.idx]
+        Y = self.y - self.v[self.idx]
+        for i in range(self.n):
+            sel = self.idx == i
+            ax.errorbar(10**X[sel],10**Y[sel],
+                        yerr=2*self.s[sel]*np.log(10)*10**Y[sel],
+                        ls='none',marker='o',
+                        label=f'{self.temp[i]:g} K, {self.press[i]:g} MPa')
+        x, g, error = self.curve()
+        ax.plot(10**x,10**g,c='k',label='master curve')
+        ax.fill_between(10**x,10**(g-error),10**(g+error),color='grey',alpha=0.3)
+        ax.set_xscale('log')
+        ax.set_yscale('log')
+        ax.set_xlabel('Reduced shear rate a*srate [1/s]')
+        ax.set_ylabel('Reduced viscosity eta/b [mPa s]')
+        ax.set_title(f'Master curve of {self.material}, reference '
+                     f'{self.temp[self.ref]:g} K, {self.press[self.ref]:g} MPa')
+        if self.n <= 12:
+            ax.legend(fontsize='small')
+        plt.show()
+        return fig,ax
@@ -9,6 +9,7 @@ lingnan.lin@nist.gov
 ALL RIGHTS RESERVED
 """
 import numpy as np
+from scipy.optimize import curve_fit
 
 def Eyring(x, eta_N, sigma_E):
     """
@@ -24,6 +25,199 @@ def Carreau(x, n, eta_N, lamda):
     """
     x: shear rate
     eta_N: Newtonian viscosity
-    lamda: relaxation time   
+    lamda: relaxation time
     """
-    return eta_N*(1+(lamda*x)**2)**((n-1)/2)
\ No newline at end of file
+    return eta_N*(1+(lamda*x)**2)**((n-1)/2)
+
+
+
+def CarreauYasuda(x, eta_N, lamda, a, n):
+    """
+    x: shear rate
+    eta_N: Newtonian viscosity
+    lamda: relaxation time
+    a: transition parameter
+    n: power-law index
+    """
+    return eta_N*(1+(lamda*x)**a)**((n-1)/a)
+
+
+
+def Cross(x, eta_N, lamda, m):
+    """
+    x: shear rate
+    eta_N: Newtonian viscosity
+    lamda: relaxation time
+    m: rate constant
+    """
+    return eta_N/(1+(lamda*x)**m)
+
+
+# ------------------------------------------------------------------------------
+#                              Model registry
+# ------------------------------------------------------------------------------
+#
+# To add a model, write the function as above and register it with
+#   register(func, params, bounds, guess, jac)
+# params: names of the parameters, in the order of the function arguments
+# bounds: (lower, upper) lists as accepted by scipy.optimize.curve_fit
+# guess:  guess(x, y) -> initial parameters estimated from the data
+# jac:    jac(x, *p) -> (len(x), len(p)) array of df/dp, or None
+
+MODELS = dict()
+
+
+class RheologyModel:
+
+    def __init__(self,func,params,bounds,guess,jac=None):
+        self.func = func
+        self.__name__ = func.__name__
+        self.params = params
+        self.bounds = bounds
+        self.guess = guess
+        self.jac = jac
+
+    def __call__(self,x,*p):
+        return self.func(x,*p)
+
+    def p0(self,x,y):
+        """
+        data-driven initial guess, moved strictly inside the bounds
+        """
+        p = np.array(self.guess(np.asarray(x,float),np.asarray(y,float)),float)
+        lb = np.array(self.bounds[0],float)
+        ub = np.array(self.bounds[1],float)
+        # margin relative to the bound span, or to the guess itself for a
+        # half-open range, so that small guesses (lamda ~ 1e-9 s) are kept
+        span = np.where(np.isfinite(ub - lb),ub - lb,np.abs(p))
+        span = np.where(span > 0,span,1.0)
+        return np.clip(p,lb + 1e-6*span,ub - 1e-6*span)
+
+
+def register(func,params,bounds,guess,jac=None):
+    model = RheologyModel(func,params,bounds,guess,jac)
+    MODELS[func.__name__] = model
+    return model
+
+
+def getmodel(model):
+    """
+    return the registered RheologyModel for a name or a model function
+    """
+    if isinstance(model,RheologyModel):
+        return model
+    name = model if isinstance(model,str) else model.__name__
+    if name not in MODELS:
+        raise KeyError(f"Model {name} is not registered. "
+                       f"Available: {', '.join(MODELS)}")
+    return MODELS[name]
+
+
+def _newtonian(x,y):
+    # low-rate plateau
+    return y[np.argmin(x)]
+
+
+def _crossover(x,y):
+    # shear rate at which the viscosity has dropped to half of the plateau
+    eta_N = _newtonian(x,y)
+    order = np.argsort(x)
+    below = np.nonzero(y[order] < 0.5*eta_N)[0]
+    if len(below):
+        return x[order][below[0]]
+    return 10*np.max(x)
+
+
+def _slope(x,y):
+    # log-log slope over the two highest shear rates (= n - 1)
+    order = np.argsort(x)[-2:]
+    if len(order) < 2:
+        return -0.5
+    lx, ly = np.log(x[order]), np.log(y[order])
+    return (ly[1] - ly[0])/(lx[1] - lx[0])
+
+
+def _jacEyring(x, eta_N, sigma_E):
+    u = eta_N/sigma_E*x
+    root = np.sqrt(u**2+1)
+    return np.column_stack([1/root,
+                            (np.arcsinh(u) - u/root)/x])
+
+
+def _jacCarreau(x, n, eta_N, lamda):
+    w = 1+(lamda*x)**2
+    f = w**((n-1)/2)
+    return np.column_stack([eta_N*f*0.5*np.log(w),
+                            f,
+                            eta_N*(n-1)*lamda*x**2*w**((n-3)/2)])
+
+
+def _jacCarreauYasuda(x, eta_N, lamda, a, n):
+    lx = lamda*x
+    w = 1+lx**a
+    g = (n-1)/a
+    f = eta_N*w**g
+    return np.column_stack([w**g,
+                            eta_N*(n-1)*w**(g-1)*lx**a/lamda,
+                            f*(-(n-1)/a**2*np.log(w) + g*lx**a*np.log(lx)/w),
+                            f*np.log(w)/a])
+
+
+def _jacCross(x, eta_N, lamda, m):
+    lx = lamda*x
+    w = 1+lx**m
+    return np.column_stack([1/w,
+                            -eta_N*m*lx**m/lamda/w**2,
+                            -eta_N*lx**m*np.log(lx)/w**2])
+
+
+register(Eyring,
+         params=['eta_N','sigma_E'],
+         bounds=([0,0],[np.inf,np.inf]),
+         guess=lambda x,y: [_newtonian(x,y),_newtonian(x,y)*_crossover(x,y)],
+         jac=_jacEyring)
+
+register(Carreau,
+         params=['n','eta_N','lamda'],
+         bounds=([0,0,0],[1,np.inf,np.inf]),
+         guess=lambda x,y: [1+_slope(x,y),_newtonian(x,y),1/_crossover(x,y)],
+         jac=_jacCarreau)
+
+register(CarreauYasuda,
+         params=['eta_N','lamda','a','n'],
+         bounds=([0,0,0.1,0],[np.inf,np.inf,10,1]),
+         guess=lambda x,y: [_newtonian(x,y),1/_crossover(x,y),2,1+_slope(x,y)],
+         jac=_jacCarreauYasuda)
+
+register(Cross,
+         params=['eta_N','lamda','m'],
+         bounds=([0,0,0],[np.inf,np.inf,1]),
+         guess=lambda x,y: [_newtonian(x,y),1/_crossover(x,y),-_slope(x,y)],
+         jac=_jacCross)
+
+
+def fit(model,xdata,ydata,yerror,verbose=0):
+    """
+    weighted least-squares fit of a registered model
+    return popt, pcov and the goodness of fit as a dict:
+    chi2 (weighted residual sum of squares), aic, bic
+    """
+    model = getmodel(model)
+    xdata = np.asarray(xdata,float)
+    ydata = np.asarray(ydata,float)
+    yerror = np.asarray(yerror,float)
+    # popt: optimized parameters
+    # pcov: covariance matrix
+    popt, pcov = curve_fit(model.func,xdata,ydata,sigma=yerror,
+                           p0=model.p0(xdata,ydata),
+                           jac=model.jac,
+                           absolute_sigma=True,
+                           bounds=model.bounds,
+                           method='trf',
+                           ftol=1e-12,xtol=1e-12,gtol=1e-12,verbose=verbose)
+    n, k = len(xdata), len(popt)
+    chi2 = np.sum(((ydata - model.func(xdata,*popt))/yerror)**2)
+    stats = {'chi2': chi2,
+             'aic': chi2 + 2*k,
+             'bic': chi2 + k*np.log(n)}
+    return popt,pcov,stats
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Gaussian-process surrogate of the NEMD viscosity, ln(eta) over
+(T, P, log10 srate), trained on ViscBatch results
+
+The block errors of the NEMD averages are used as the noise of each
+observation. The Cholesky factor of the kernel matrix is stored on disk and
+extended (block Cholesky) when new state points are added, so the
+O(n^3) factorisation is only paid once. For m query points the predicted
+mean costs O(n*m) and its variance a triangular solve, O(n^2*m).
+"""
+
+import numpy as np
+import os
+from scipy.linalg import cho_solve, cholesky, solve_triangular
+from scipy.optimize import minimize
+
+
+def _rbf(X1,X2,lengths,amp):
+    """
+    squared-exponential kernel with one length scale per input
+    """
+    A = X1 / lengths
+    B = X2 / lengths
+    d2 = np.sum(A**2,axis=1)[:,None] + np.sum(B**2,axis=1)[None,:] - 2*A @ B.T
+    return amp**2 * np.exp(-0.5*np.maximum(d2,0))
+
+
+def batchdata(batches):
+    """
+    inputs, ln(eta) and the noise variance of ln(eta) for a list of ViscBatch
+    the errors in results are expanded (2 sigma) errors
+    """
+    X, y, noise = [], [], []
+    for vba in batches:
+        temp = float(str(vba.temp).upper().rstrip('K'))
+        press = float(str(vba.press).upper().replace('MPA',''))
+        res = vba.results
+        srate = res['srate'].to_numpy(dtype=float)
+        eta = res['viscosity'].to_numpy(dtype=float)
+        se = res['error'].to_numpy(dtype=float)/2
+        X.append(np.column_stack([np.full(len(res),temp),
+                                  np.full(len(res),press),
+                                  np.log10(srate)]))
+        y.append(np.log(eta))
+        noise.append((se/eta)**2)
+    return np.vstack(X),np.concatenate(y),np.concatenate(noise)
+
+
+class Surrogate:
+
+    def __init__(self,path=None):
+        self.path = path # .npz file holding the cached factorisation
+        self.X = np.empty((0,3))
+        self.y = np.empty(0)
+        self.noise = np.empty(0)
+        self.lengths = np.array([20.0,50.0,1.0]) # T [K], P [MPa], log10 srate
+        self.amp = 1.0
+        self.mean = 0.0
+        self.L = np.empty((0,0))
+        self.alpha = np.empty(0)
+        if path is not None and os.path.isfile(path):
+            self.load(path)
+
+    def info(self,ifprint=True):
+        s = 'GP surrogate: {} points, length scales T {:.1f} K, P {:.1f} MPa, ' \
+            'log10(srate) {:.2f}'.format(len(self.y),*self.lengths)
+        if ifprint:
+            print(s)
+        return s
+
+    def _kernel(self,X1,X2):
+        return _rbf(X1,X2,self.lengths,self.amp)
+
+    def _factorize(self):
+        K = self._kernel(self.X,self.X) + np.diag(self.noise + 1e-10)
+        self.L = cholesky(K,lower=True)
+        self._solve()
+
+    def _solve(self):
+        self.alpha = cho_solve((self.L,True),self.y - self.mean)
+
+    def _nll(self,theta):
+        # negative log marginal likelihood, theta = log(lengths, amp)
+        lengths, amp = np.exp(theta[:3]), np.exp(theta[3])
+        K = _rbf(self.X,self.X,lengths,amp) + np.diag(self.noise + 1e-10)
+        try:
+            L = cholesky(K,lower=True)
+        except np.linalg.LinAlgError:
+            return np.inf
+        r = self.y - self.mean
+        a = cho_solve((L,True),r)
+        return 0.5*r @ a + np.sum(np.log(np.diag(L)))
+
+    def fit(self,optimize=True):
+        """
+        (re)build the factorisation from scratch, optionally optimizing
+        the length scales and amplitude by maximum marginal likelihood
+        """
+        self.mean = self.y.mean()
+        if optimize and len(self.y) > 3:
+            theta0 = np.log(np.append(self.lengths,max(self.y.std(),1e-3)))
+            res = minimize(self._nll,theta0,method='L-BFGS-B',
+                           bounds=[(-5,10)]*4)
+            self.lengths, self.amp = np.exp(res.x[:3]), np.exp(res.x[3])
+        self._factorize()
+        self.save()
+        return self
+
+    def add(self,batches):
+        """
+        add the results of new ViscBatch instances
+        points already in the surrogate are skipped; the Cholesky factor
+        is extended with the new rows instead of being recomputed
+        """
+        X2, y2, n2 = batchdata(batches)
+        if len(self.X):
+            new = ~np.any(np.all(np.isclose(X2[:,None,:],self.X[None,:,:]),
+                                 axis=-1),axis=1)
+            X2, y2, n2 = X2[new], y2[new], n2[new]
+        if len(X2) == 0:
+            print("No new state points")
+            return self
+        if len(self.y) == 0:
+            self.X, self.y, self.noise = X2, y2, n2
+            return self.fit()
+
+        # block Cholesky update:
+        # [[L, 0], [B^T, L22]] with B = L^-1 K12, L22 = chol(K22 - B^T B)
+        K12 = self._kernel(self.X,X2)
+        K22 = self._kernel(X2,X2) + np.diag(n2 + 1e-10)
+        B = solve_triangular(self.L,K12,lower=True)
+        L22 = cholesky(K22 - B.T @ B,lower=True)
+        n1 = len(self.y)
+        L = np.zeros((n1+len(X2),n1+len(X2)))
+        L[:n1,:n1] = self.L
+        L[n1:,:n1] = B.T
+        L[n1:,n1:] = L22
+        self.L = L
+        self.X = np.vstack([self.X,X2])
+        self.y = np.concatenate([self.y,y2])
+        self.noise = np.concatenate([self.noise,n2])
+        self._solve()
+        self.save()
+        print(f"Added {len(X2)} points, {len(self.y)} in total")
+        return self
+
+    def predict(self,temp,press,srate):
+        """
+        viscosity [mPa s] and expanded error (95 % confidence interval)
+        at any number of query points; arguments broadcast together
+        """
+        temp, press, srate = np.broadcast_arrays(np.asarray(temp,float),
+                                                 np.asarray(press,float),
+                                                 np.asarray(srate,float))
+        Xq = np.column_stack([temp.ravel(),press.ravel(),
+                              np.log10(srate.ravel())])
+        Kq = self._kernel(Xq,self.X)
+        mu = self.mean + Kq @ self.alpha
+        v = solve_triangular(self.L,Kq.T,lower=True)
+        var = np.maximum(self.amp**2 - np.sum(v**2,axis=0),0)
+        eta = np.exp(mu)
+        error = 2*np.sqrt(var)*eta  # first-order propagation from ln(eta)
+        return eta.reshape(temp.shape),error.reshape(temp.shape)
+
+    def save(self,path=None):
+        path = path or self.path
+        if path is None:
+            return
+        np.savez(path,X=self.X,y=self.y,noise=self.noise,
+                 lengths=self.lengths,amp=self.amp,mean=self.mean,
+                 L=self.L,alpha=self.alpha)
+
+    def load(self,path):
+        with np.load(path) as f:
+            self.X, self.y, self.noise = f['X'], f['y'], f['noise']
+            self.lengths, self.amp = f['lengths'], float(f['amp'])
+            self.mean = float(f['mean'])
+            self.L, self.alpha = f['L'], f['alpha']
+        return self
@@ -79,11 +79,13 @@ def copy(rootdir=r"F:\NEMD\data\new",keyword='visc',rename=False):
 
 
 def standardname(basename):
-    [material, temp, press, srate]= \
-        basename.strip('.txt').strip('visc_').split('_')
+    [material, temp, press, srate, replica] = vp.parsename(basename)
     srate = vp.standardsrate(srate)
+    name = 'visc_' + material + '_' + temp +'_' + press + '_' + srate
+    if replica is not None:
+        name += '_' + replica
     
-    return 'visc_' + material + '_' + temp +'_' + press + '_' + srate + '.txt'
+    return name + '.txt'
 
 
 def changeName (oldname):
@@ -14,27 +14,71 @@ import pandas as pd
 import numpy as np
 import os
 import lmpoutpost as lmp
+import rheologymodels as rm
 from rheologymodels import Eyring
-from scipy.optimize import curve_fit
+from concurrent.futures import ProcessPoolExecutor
 from math import ceil
+from scipy import stats
 
 class Viscdata:
-    
+    """
+    NEMD viscosity time series of one state point and shear rate.
+
+    The (step, viscosity) columns are held in a single contiguous float
+    array; time, strain and the DataFrame views are derived on access, and
+    the steady-state window is stored as index bounds [ssbegin, ssend)
+    into that array, so no copy of the series is ever made.
+    """
+
+    __slots__ = ('material','temp','press','srate','replica','dt','outputfreq',
+                 'array','columns','sslength','ssbegin','ssend')
+
     def __init__(self,material,temp,press,srate,data,
-                dt=0.5,outputfreq=100000):
+                dt=0.5,outputfreq=100000,replica=None):
         self.material = material
         self.temp = temp # temperature [K]
         self.press = press # pressure [MPa]
         self.srate = standardsrate(srate) # shear rate [s^-1]
+        self.replica = replica # replica tag, e.g. 'r2'; None for a single run
         self.dt = dt # timestep in fs; =0.5 by default
-        self.data = data
-        self.step = data.iloc[:,0]
-        self.time = self.dt * self.step * 1e-6 # in ns
-        self.strain = float(srate)*self.time*1e-9
-        self.visc = data.iloc[:,1] # viscosity
-        self.sslength = 20  # length of steady-state [ns]. Default: 20 ns
-        self.ssdata = self.data.iloc[-int(self.sslength/(self.dt*1e-6)/outputfreq):]
         self.outputfreq = outputfreq # = 100000 by default
+        if isinstance(data,pd.DataFrame):
+            self.columns = tuple(data.columns[:2])
+            data = data.iloc[:,:2].to_numpy(dtype=float)
+        else:
+            self.columns = ('TimeStep','visc')
+        # columns: step, viscosity
+        self.array = np.ascontiguousarray(data[:,:2],dtype=float)
+        self.sslength = 20  # length of steady-state [ns]. Default: 20 ns
+        n = len(self.array)
+        self.ssbegin = max(n - int(self.sslength/(self.dt*1e-6)/outputfreq),0)
+        self.ssend = n
+
+    @property
+    def step(self):
+        return pd.Series(self.array[:,0],name=self.columns[0],copy=False)
+
+    @property
+    def time(self):
+        return self.dt * self.step * 1e-6 # in ns
+
+    @property
+    def strain(self):
+        return float(self.srate)*self.time*1e-9
+
+    @property
+    def visc(self):
+        # viscosity
+        return pd.Series(self.array[:,1],name=self.columns[1],copy=False)
+
+    @property
+    def data(self):
+        return pd.DataFrame(self.array,columns=list(self.columns),copy=False)
+
+    @property
+    def ssdata(self):
+        return pd.DataFrame(self.array[self.ssbegin:self.ssend],
+                            columns=list(self.columns),copy=False)
 
     
     def info(self,ifprint=True):
@@ -45,6 +89,8 @@ class Viscdata:
                                               self.temp,
                                               self.press,
                                               self.srate)
+        if self.replica is not None:
+            s += ', ' + self.replica
         if ifprint:
             print(s)
         return s
@@ -93,9 +139,11 @@ class Viscdata:
             set steady state start at ts [ns]
         """
         ts_step = int(ts / (self.dt * 1e-6))
-        self.sslength = self.time.iloc[-1] - ts
-        self.ssdata = self.data[self.step >= ts_step]
-        print("Set steady state as from {} ns to {} ns".format(ts,self.time.iloc[-1]))
+        tend = self.array[-1,0] * self.dt * 1e-6
+        self.sslength = tend - ts
+        self.ssbegin = np.searchsorted(self.array[:,0],ts_step,side='left')
+        self.ssend = len(self.array)
+        print("Set steady state as from {} ns to {} ns".format(ts,tend))
         print("Production length: {} ns".format(self.sslength))
     
     
@@ -108,8 +156,8 @@ class Viscdata:
         step_begin = int(t_begin / (self.dt * 1e-6))
         step_end = int(t_end / (self.dt * 1e-6))
         self.sslength = t_end - t_begin
-        self.ssdata = self.data[(self.step >= step_begin) \
-                                & (self.step <= step_end)]
+        self.ssbegin = np.searchsorted(self.array[:,0],step_begin,side='left')
+        self.ssend = np.searchsorted(self.array[:,0],step_end,side='right')
         print("Set steady state as from {} ns to {} ns".format(t_begin,t_end))
         print("Production length: {} ns".format(self.sslength))        
 
@@ -118,7 +166,7 @@ class Viscdata:
         if ifprint:
             print("Production length: {:.1f} ns".format(self.sslength))        
         # here, error is 95 % confidence interval
-        mean,error = lmp.blockAverage(self.ssdata.visc,
+        mean,error = lmp.blockAverage(self.array[self.ssbegin:self.ssend,1],
                                       blocknum,
                                       style='blocknum',
                                       ifprint=ifprint)
@@ -126,13 +174,55 @@ class Viscdata:
         return mean,error
 
 
+    def sensitivity(self,tstarts=None,blocknums=range(5,21),ifplot=False):
+        """
+        mean and error of the viscosity over a grid of steady-state start
+        times [ns] and block numbers, computed in one pass
+        tstarts: default are 10 starts between t=1/srate and halfway
+                 to the end of the run
+        stability score: largest deviation of the grid means from the
+        current estimate (average()), in units of its expanded error;
+        > 1 means the reported value depends on the choice of window/blocks
+        return a dict with tstart, blocknum, mean, error (2-D) and score
+        """
+        step = self.array[:,0]
+        if tstarts is None:
+            i0 = np.searchsorted(step,1/float(self.srate)*1e15/self.dt)
+            i0 = min(i0,len(step)//2)
+            starts = np.linspace(i0,i0 + (len(step) - i0)//2,10).astype(int)
+        else:
+            ts_step = np.asarray(tstarts) / (self.dt * 1e-6)
+            starts = np.searchsorted(step,ts_step,side='left')
+        blocknums = np.asarray(blocknums)
+        mean,error = lmp.blockGrid(self.array[:,1],starts,blocknums)
+        ref_mean,ref_error = self.average()
+        score = np.nanmax(np.abs(mean - ref_mean)) / ref_error
+        grid = {'tstart': step[starts]*self.dt*1e-6,
+                'blocknum': blocknums,
+                'mean': mean,
+                'error': error,
+                'score': score}
+        if ifplot:
+            fig, ax = plt.subplots(1,2,figsize=(10,4),constrained_layout=True)
+            fig.suptitle(self.info(ifprint=False) + f'\n stability score = {score:.2f}')
+            extent = [blocknums[0],blocknums[-1],grid['tstart'][0],grid['tstart'][-1]]
+            for axi,z,label in zip(ax,[mean,error/mean*100],
+                                   ['viscosity [mPa s]','relative error [%]']):
+                im = axi.imshow(z,aspect='auto',origin='lower',extent=extent)
+                axi.set_xlabel('block number')
+                axi.set_ylabel('steady-state start [ns]')
+                fig.colorbar(im,ax=axi,label=label)
+            plt.show()
+        return grid
+
+
 class ViscBatch:
     
     def __init__(self,visclist,results):
         self.material = visclist[0].material
         self.temp = visclist[0].temp
         self.press = visclist[0].press
-        self.srate = [f.srate for f in visclist]
+        self.srate = list(dict.fromkeys(f.srate for f in visclist))
         self.visclist = visclist
         self.results = results
         # self.dict = dict()
@@ -152,14 +242,16 @@ class ViscBatch:
         return s
  
        
-    def get(self,srate):
+    def get(self,srate,replica=None):
         """
         retrieve the ViscData via the corresponding shear rate as the key
+        replica: replica tag; the first replica is returned if None
         """
         srate = standardsrate(srate)
         file_exist = False # flag
         for viscdata in self.visclist:
-            if srate == viscdata.srate:
+            if srate == viscdata.srate and \
+                (replica is None or replica == viscdata.replica):
                 file_exist = True
                 return viscdata
         if not file_exist:
@@ -168,15 +260,17 @@ class ViscBatch:
 
     def plot(self,model=Eyring,color='b',xlim=(1e6,1e11),ylim=(1,100)):
         """
-        plot viscosity versus shear rate
-    
+        plot viscosity versus shear rate with the fit of model
+        (a model function or a name registered in rheologymodels)
+        return [eta_N, error] and [value, error] of the other parameters
         """
         # plot the data
         plt.errorbar(self.results.iloc[:,0],self.results.iloc[:,1],
                       yerr=self.results.iloc[:,2],
                       ls='none',marker='o',color=color)
         # plot the fit
-        popt,perr = self.fit(Eyring)
+        model = rm.getmodel(model)
+        popt,perr = self.fit(model)
         x = np.logspace(np.log10(xlim)[0],np.log10(xlim)[1],100)
         y = model(x,*popt)
         plt.plot(x,y,c=color,label=self.info())
@@ -189,33 +283,22 @@ class ViscBatch:
         plt.xlabel('Shear rate [1/s]')
         plt.ylabel('Viscosity [mPa s]')
         
-        eta_N, sigma_E = popt
-        ee_eta_N, ee_sigma_E = 2 * perr  
-        # note: perr is standard error
-        # expanded error = coverage factor * standard error
-        
-        
-        print('-'*60)
-        print("Fit parameters:")
-        print(f"eta_N: {eta_N:.1f} +- {ee_eta_N:.1f}")
-        print(f"sigma_E: {sigma_E:.1e} +- {ee_sigma_E:.1e}")
-        print("-"*60)      
-        # note: perr is standard error not confifence interval
-        return [eta_N,ee_eta_N],[sigma_E,ee_sigma_E]
+        return _printfit(model,popt,perr)
 
 
     def axplot(self,ax,model=Eyring,
              color='b',xlim=(1e6,1e11),ylim=(1,100)):
         """
         for use of multiple plots
-        plot viscosity versus shear rate
+        plot viscosity versus shear rate; see plot
         """
         # plot the data
         ax.errorbar(self.results.iloc[:,0],self.results.iloc[:,1],
                      yerr=self.results.iloc[:,2],
                      ls='none',marker='o',color=color)
         # plot the fit
-        popt,perr = self.fit(Eyring)
+        model = rm.getmodel(model)
+        popt,perr = self.fit(model)
         x = np.logspace(np.log10(xlim)[0],np.log10(xlim)[1],100)
         y = model(x,*popt)
         ax.plot(x,y,c=color,label=self.info())
@@ -228,19 +311,7 @@ class ViscBatch:
         ax.set_xlabel('Shear rate [1/s]')
         ax.set_ylabel('Viscosity [mPa s]')
         
-        eta_N, sigma_E = popt
-        ee_eta_N, ee_sigma_E = 2 * perr  
-        # note: perr is standard error
-        # expanded error = coverage factor * standard error
-        
-        print('-'*60)
-        print("Fit parameters:")
-        print(f"eta_N: {eta_N:.1f} +- {ee_eta_N:.1f}")
-        print(f"sigma_E: {sigma_E:.1e} +- {ee_sigma_E:.1e}")
-        print("-"*60)      
-        # note: perr is standard error not confifence interval
-        
-        return [eta_N,ee_eta_N],[sigma_E,ee_sigma_E],ax
+        return (*_printfit(model,popt,perr),ax)
 
     
     def plotall(self):
@@ -256,7 +327,8 @@ class ViscBatch:
                                )
         fig.suptitle(self.info(),fontsize=16)
         for f,axi in zip(self.visclist,ax.flat):
-            axi.set_title(f.srate)
+            axi.set_title(f.srate if f.replica is None
+                          else f'{f.srate}, {f.replica}')
             axi.scatter(f.time,f.visc,marker="+")
             axi.axvline(1/float(f.srate)*1e9,linestyle='--',
                       c='b',label='t=1/srate={:.1f} ns'.format(1/float(f.srate)*1e9))
@@ -274,24 +346,18 @@ class ViscBatch:
     
     def fit(self,model):
         """
-        model = Eyring,Carreau, ...
+        model = Eyring,Carreau, ... or any model in rheologymodels.MODELS
+        initial guesses, bounds and Jacobian are taken from the registry
         """
-        print(f"Fit model: {model.__name__}")
+        print(f"Fit model: {rm.getmodel(model).__name__}")
         # print(f"Fitting info:")
         xdata = self.results['srate'].to_numpy()
         ydata = self.results['viscosity'].to_numpy()
         yerror = self.results['error'].to_numpy()
         # popt: optimized parameters
         # pcov: covariance matrix
-        
-            
-        popt, pcov = curve_fit(model,xdata,ydata,sigma=yerror,p0=[10,1e10],
-                               absolute_sigma=True,
-                               bounds=(0,np.inf),
-                               method='trf',
-                               ftol=1e-12,xtol=1e-12,gtol=1e-12,verbose=2)
-           
-        # ftol=1e-12,xtol=1e-12,
+        popt, pcov, stats = rm.fit(model,xdata,ydata,yerror,verbose=2)
+
         # perr: standard errors of the parameters
         # equal to square root of the diagnol of the covariance matrix
         perr = np.sqrt(np.diag(pcov))     
@@ -299,6 +365,15 @@ class ViscBatch:
         return popt,perr
 
 
+    def fitall(self,models=None,nproc=None):
+        """
+        fit every registered model (or the given list) in parallel
+        and rank them by AIC
+        return a DataFrame, one row per model
+        """
+        return fitall([self],models=models,nproc=nproc)
+
+
     def erying(self,**kwargs):
         
         popt,perr = self.plot(model=Eyring,**kwargs)
@@ -332,6 +407,254 @@ class ViscBatch:
         print(f"Saved to {path}")
     
     
+    def sensitivity(self,threshold=1.0,**kwargs):
+        """
+        steady-state/blocking sensitivity for every shear rate
+        a state point is flagged as fragile when its stability score
+        exceeds threshold
+        return a DataFrame, one row per shear rate (and replica)
+        """
+        rows = []
+        for f in self.visclist:
+            grid = f.sensitivity(**kwargs)
+            rows.append([float(f.srate),f.replica,
+                         np.nanmin(grid['mean']),np.nanmax(grid['mean']),
+                         np.nanmax(grid['error']),grid['score']])
+        table = pd.DataFrame(rows,columns=['srate','replica','min','max',
+                                           'max error','score'])
+        table['fragile'] = table['score'] > threshold
+        if table['fragile'].any():
+            print("Fragile shear rates: " + ", ".join(
+                standardsrate(x) for x in table.loc[table['fragile'],'srate']))
+        return table
+
+
+    def normalstress(self,root=r"F:\NEMD\data\archive_nemd",
+                     filename='Ptensor.out',blocknum=10):
+        """
+        normal-stress differences and pressure for every shear rate
+        root: location of the NEMD run directories; the tensor output
+              (Ptensor.out, full pressure tensor in atm) is read from the
+              directory that holds the visc_ file of each shear rate;
+              KEtensor.out and virial.out (no kinetic term) are rejected
+        The steady-state window of each Viscdata is applied; replicas of a
+        shear rate are combined by inverse-variance weighting.
+        The results are added to self.results (N1, N2, pressure in MPa,
+        with their expanded errors) and returned.
+        """
+        if not filename.startswith('Ptensor'):
+            raise ValueError(f"{filename} is not a full pressure tensor: "
+                             "KEtensor.out is in energy units and "
+                             "virial.out has no kinetic term")
+        runs = dict()
+        for subdir, dirs, files in os.walk(root):
+            if filename not in files:
+                continue
+            for file in files:
+                if file.startswith('visc_') and (self.material in file) \
+                    and (self.temp in file) and (self.press in file):
+                    srate, replica = parsename(file)[3:]
+                    runs[standardsrate(srate),replica] = os.path.join(subdir,
+                                                                      filename)
+
+        groups = dict()
+        for f in self.visclist:
+            if (f.srate,f.replica) not in runs:
+                print(f"{filename} for {f.info(ifprint=False)} not found")
+                continue
+            df = lmp.loadlmpout(runs[f.srate,f.replica])
+            step = df.iloc[:,0].to_numpy()
+            ss = (step >= f.array[f.ssbegin,0]) & (step <= f.array[f.ssend-1,0])
+            table = lmp.tensorAverage(df[ss],blocknum)
+            groups.setdefault(float(f.srate),[]).append(
+                table.loc[['N1','N2','pressure']])
+        rows = []
+        for srate,tables in groups.items():
+            row = [srate]
+            for var in ['N1','N2','pressure']:
+                mean,error = combine([t.loc[var,'mean'] for t in tables],
+                                     [t.loc[var,'error'] for t in tables])[:2]
+                row += [mean,error]
+            rows.append(row)
+        stress = pd.DataFrame(rows,columns=['srate','N1','N1 error',
+                                            'N2','N2 error',
+                                            'pressure','pressure error'])
+        self.results = self.results.drop(columns=stress.columns[1:],
+                                         errors='ignore') \
+                                   .merge(stress,on='srate',how='left')
+        return stress
+
+
+    def plan(self,model=Eyring,nruns=5,srates=None,lengths=(10,20,40)):
+        """
+        rank additional NEMD runs by how much they shrink the confidence
+        interval of eta_N per simulated ns
+
+        The error of a new run is predicted from the existing ones assuming
+        error ~ c/(srate*sqrt(length)) (the stress noise is roughly rate
+        independent); its cost is the transient 1/srate plus the
+        production length [ns]. Every (srate, length) candidate is scored
+        at once with a rank-one (Sherman-Morrison) update of the fit
+        covariance; the best run is kept and the search repeated nruns
+        times.
+        srates: candidate shear rates [1/s]; default 1e6 to 1e11, 4 per decade
+        lengths: candidate production lengths [ns]
+        return a DataFrame of the selected runs, in order
+        """
+        model = rm.getmodel(model)
+        xdata = self.results['srate'].to_numpy()
+        ydata = self.results['viscosity'].to_numpy()
+        yerror = self.results['error'].to_numpy()
+        # fit with standard errors, so that pcov is on the same scale as
+        # the standard error of the candidate runs below
+        popt, pcov, stats = rm.fit(model,xdata,ydata,yerror/2)
+        k = model.params.index('eta_N')
+
+        # error model calibrated on the existing runs (2 sigma errors)
+        # replicas of a shear rate count as one run of their total length
+        length = np.array([sum(f.sslength for f in self.visclist
+                               if float(f.srate) == x) for x in xdata])
+        c = np.median(yerror*xdata*np.sqrt(length))
+
+        if srates is None:
+            srates = np.logspace(6,11,21)
+        x, L = np.meshgrid(np.asarray(srates,float),np.asarray(lengths,float),
+                           indexing='ij')
+        x, L = x.ravel(), L.ravel()
+        sigma = c/(x*np.sqrt(L))/2   # standard error
+        cost = 1e9/x + L             # simulated time [ns]
+        J = model.jac(x,*popt)       # (ncandidate, nparam)
+
+        cov = pcov.copy()
+        rows = []
+        for i in range(nruns):
+            CJ = J @ cov                              # (ncandidate, nparam)
+            denom = sigma**2 + np.einsum('ij,ij->i',CJ,J)
+            gain = CJ[:,k]**2/denom/cost              # variance reduction per ns
+            best = np.argmax(gain)
+            cov = cov - np.outer(CJ[best],CJ[best])/denom[best]
+            rows.append([x[best],L[best],cost[best],2*sigma[best],
+                         2*np.sqrt(cov[k,k]),gain[best]])
+        table = pd.DataFrame(rows,columns=['srate','length','cost',
+                                           'expected error','eta_N error',
+                                           'gain'])
+        print(f"eta_N error now: {2*np.sqrt(pcov[k,k]):.2f} mPa s")
+        print(table.to_string(index=False))
+        return table
+
+
+    def transient(self,window=10,ngrid=200,ifplot=False):
+        """
+        start-up transient of every shear rate on a common strain grid
+
+        All series are smoothed (moving average of `window` samples) and
+        resampled onto ngrid log-spaced strains in one vectorized step.
+        For each run, relative to its steady-state average (average()):
+            overshoot       (peak - steady)/steady
+            strain at peak
+            strain to steady state: from there on the smoothed series
+                stays within the steady-state band (error + 2 std of the
+                smoothed series in the steady-state window)
+            transient time [ns] and its fraction of the run length
+            (NaN, and settled = False, if the run never settles)
+        Errors are expanded (95 %); the strain errors are half the range
+        obtained with a band half/twice as wide (peak: within 2 std);
+        NaN if either of these bands is never reached.
+        return a DataFrame (one row per run), the strain grid and the
+        resampled (run x strain) array
+        """
+        n = len(self.visclist)
+        lengths = np.array([len(f.array) for f in self.visclist])
+        L = lengths.max()
+        # padded (run x sample) arrays
+        visc = np.full((n,L),np.nan)
+        for i,f in enumerate(self.visclist):
+            visc[i,:lengths[i]] = f.array[:,1]
+        srate = np.array([float(f.srate) for f in self.visclist])
+        dt = np.array([f.dt for f in self.visclist])
+        t0 = np.array([f.array[0,0] for f in self.visclist])*dt*1e-6   # ns
+        dtime = np.array([f.array[1,0]-f.array[0,0]
+                          for f in self.visclist])*dt*1e-6            # ns
+
+        # trailing moving average via cumulative sums
+        csum = np.concatenate([np.zeros((n,1)),
+                               np.cumsum(np.nan_to_num(visc),axis=1)],axis=1)
+        smooth = np.full((n,L),np.nan)
+        smooth[:,window-1:] = (csum[:,window:] - csum[:,:-window])/window
+        smooth[np.arange(L)[None,:] >= lengths[:,None]] = np.nan
+
+        # common log-spaced strain grid
+        strain0 = srate*(t0 + (window-1)*dtime)*1e-9
+        strain1 = srate*(t0 + (lengths-1)*dtime)*1e-9
+        grid = np.logspace(np.log10(strain0.min()),np.log10(strain1.max()),ngrid)
+        # fractional sample index of every grid strain for every run
+        frac = (grid[None,:]/srate[:,None]*1e9 - t0[:,None])/dtime[:,None]
+        valid = (frac >= window-1) & (frac <= lengths[:,None]-1)
+        j = np.clip(np.floor(frac).astype(int),0,L-2)
+        w = frac - j
+        rows = np.arange(n)[:,None]
+        resampled = (1-w)*smooth[rows,j] + w*smooth[rows,j+1]
+        resampled[~valid] = np.nan
+
+        # steady-state reference of each run
+        ss = np.array([f.average() for f in self.visclist])
+        eta, err = ss[:,0], ss[:,1]
+        ssmask = np.zeros((n,L),dtype=bool)
+        for i,f in enumerate(self.visclist):
+            ssmask[i,f.ssbegin:f.ssend] = True
+        noise = np.sqrt(np.nanmean(np.where(ssmask,smooth - eta[:,None],np.nan)**2,
+                                   axis=1))
+
+        # overshoot
+        peak = np.nanmax(resampled,axis=1)
+        ipeak = np.nanargmax(resampled,axis=1)
+        overshoot = (peak - eta)/eta
+        overshoot_err = 2*np.sqrt(noise**2 + (err/2)**2)/eta
+        near = resampled >= (peak - 2*noise)[:,None]
+        gpeak = np.where(near,grid[None,:],np.nan)
+        peak_err = 0.5*(np.nanmax(gpeak,axis=1) - np.nanmin(gpeak,axis=1))
+
+        def settle(band):
+            # first grid strain after which the series stays inside the band
+            inside = (np.abs(resampled - eta[:,None]) <= band[:,None]) | ~valid
+            stays = np.flip(np.cumprod(np.flip(inside,axis=1),axis=1),axis=1)
+            stays = stays.astype(bool) & valid
+            first = np.argmax(stays,axis=1)
+            # NaN for runs that never return to the band
+            return np.where(stays.any(axis=1),grid[first],np.nan)
+        band = err + 2*noise
+        strain_ss = settle(band)
+        strain_ss_err = 0.5*np.abs(settle(0.5*band) - settle(2*band))
+
+        t_ss = strain_ss/srate*1e9
+        t_run = t0 + (lengths-1)*dtime
+        table = pd.DataFrame({'srate': srate,
+                              'replica': [f.replica for f in self.visclist],
+                              'overshoot': overshoot,
+                              'overshoot error': overshoot_err,
+                              'strain at peak': grid[ipeak],
+                              'strain at peak error': peak_err,
+                              'strain to ss': strain_ss,
+                              'strain to ss error': strain_ss_err,
+                              'transient [ns]': t_ss,
+                              'transient fraction': t_ss/t_run,
+                              'settled': np.isfinite(strain_ss)})
+        if ifplot:
+            fig, ax = plt.subplots(constrained_layout=True)
+            for i,f in enumerate(self.visclist):
+                line, = ax.plot(grid,resampled[i]/eta[i],label=f.srate)
+                if np.isfinite(strain_ss[i]):
+                    ax.axvline(strain_ss[i],ls=':',c=line.get_color())
+            ax.axhline(1,ls='--',c='k')
+            ax.set_xscale('log')
+            ax.set_xlabel('strain [-]')
+            ax.set_ylabel('viscosity / steady-state viscosity')
+            ax.set_title(self.info())
+            ax.legend(fontsize='small')
+            plt.show()
+        return table,grid,resampled
+
+
     def print(self):
         print("Results:")
         pd.set_option('precision',1)
@@ -342,17 +665,11 @@ def loadvisc(filename,ifplot=True):
     """
         load data from a LAMMPS output file to a DataFrame
     """
-    if os.path.isabs(filename):
-        basename = os.path.basename(filename)
-    else:
-        basename = filename
-    # parse filename:
-    [material, temp, press, srate]= \
-        basename.strip('.txt').strip('visc_').split('_')
+    material, temp, press, srate, replica = parsename(filename)
        
     df = lmp.loadlmpout(filename)    
     
-    vd = Viscdata(material,temp,press,srate,df)
+    vd = Viscdata(material,temp,press,srate,df,replica=replica)
     
     if ifplot:
         vd.plot()
@@ -360,9 +677,81 @@ def loadvisc(filename,ifplot=True):
     return vd 
 
 
-def readvisc(material,temp,press,srate,ifplot=True):
+def parsename(filename):
+    """
+    parse a viscosity file name:
+        visc_MAT_T_P_SRATE.txt      single run
+        visc_MAT_T_P_SRATE_REP.txt  independent replica REP (e.g. r2)
+    return material, temp, press, srate, replica (None for a single run)
+    """
+    basename = os.path.basename(filename)
+    if basename.startswith('visc_'):
+        basename = basename[len('visc_'):]
+    if basename.endswith('.txt'):
+        basename = basename[:-len('.txt')]
+    fields = basename.split('_')
+    if len(fields) == 4:
+        fields.append(None)
+    if len(fields) != 5:
+        raise ValueError(f"Unexpected viscosity file name: {filename}")
+    return tuple(fields)
+
+
+def combine(means,errors):
+    """
+    inverse-variance weighted mean of independent estimates
+    errors: expanded errors (95 % confidence interval)
+    return mean, expanded error, Birge ratio and the p-value of the
+    chi-square consistency test (a small p-value means the replicas
+    disagree by more than their errors allow)
+    """
+    means = np.asarray(means,dtype=float)
+    errors = np.asarray(errors,dtype=float)
+    w = 1/errors**2
+    mean = np.sum(w*means)/np.sum(w)
+    error = 1/np.sqrt(np.sum(w))
+    n = len(means)
+    if n < 2:
+        return mean,error,np.nan,np.nan
+    # chi-square with standard errors (= expanded error / 2)
+    chi2 = np.sum(((means - mean)/(errors/2))**2)
+    birge = np.sqrt(chi2/(n-1))
+    pvalue = stats.chi2.sf(chi2,n-1)
+    return mean,error,birge,pvalue
+
+
+def _printfit(model,popt,perr):
+    """
+    print the fitted parameters of a registered model with expanded errors
+    return [eta_N, error] followed by [value, error] of the other parameters
+    in the order of model.params (Eyring: eta_N, sigma_E)
+    """
+    # note: perr is standard error
+    # expanded error = coverage factor * standard error
+    pairs = [[p,2*e] for p,e in zip(popt,perr)]
+    print('-'*60)
+    print("Fit parameters:")
+    for name,(p,e) in zip(model.params,pairs):
+        if name == 'eta_N':
+            print(f"{name}: {p:.1f} +- {e:.1f}")
+        else:
+            print(f"{name}: {p:.2e} +- {e:.1e}")
+    print("-"*60)
+    eta_N = pairs.pop(model.params.index('eta_N'))
+    return (eta_N,*pairs)
+
+
+def _loadTask(abspath):
+    # top-level so that it can be sent to a process pool
+    f = loadvisc(abspath,ifplot=False)
+    return f,f.average()
+
+
+def readvisc(material,temp,press,srate,ifplot=True,replica=None):
     """
     read a nemd file by state point parameters
+    replica: replica tag, e.g. 'r2'; if None, the single run or else the
+             first replica is read
     default location: 'F:\\NEMD\\data\\visc'
     """
     temp = str(temp).upper()
@@ -370,23 +759,34 @@ def readvisc(material,temp,press,srate,ifplot=True):
     srate = standardsrate(srate)
     # root = "F:\\NEMD\\data\\" + material + '_visc'
     root = r"F:\NEMD\data\visc"
-    flag = False
+    matches = dict()
     for root, subdirs, files in os.walk(root):
         for file in files:
-            if (material in file) and (temp in file) \
-                and (press in file) and (srate in file):    
-                f = loadvisc(os.path.join(root,file),ifplot=ifplot)
-                flag = True
-    if not flag:
+            if not file.startswith('visc_'):
+                continue
+            try:
+                fields = parsename(file)
+            except ValueError:
+                continue
+            if fields[:3] == (material,temp,press) \
+                and standardsrate(fields[3]) == srate \
+                and (replica is None or fields[4] == replica):
+                matches[fields[4]] = os.path.join(root,file)
+    if not matches:
         print("File not found!")
         return
-    else:
-        return f
+    # single run (no tag) first, then replicas in order
+    key = sorted(matches,key=lambda r: (r is not None,r or ''))[0]
+    return loadvisc(matches[key],ifplot=ifplot)
 
 
-def batch(material,temp,press,isnew=False):
+def batch(material,temp,press,isnew=False,nproc=None):
     """
     calculate blcok average for a batch of nemd files
+    Replicas of the same shear rate (visc_MAT_T_P_SRATE_REP.txt) are
+    combined by inverse-variance weighting; results also report the number
+    of replicas and their consistency (Birge ratio, chi-square p-value).
+    nproc: number of processes used to load the files (all cores if None)
     return a ViscBatch instance
     """
     temp = str(temp)
@@ -402,37 +802,164 @@ def batch(material,temp,press,isnew=False):
     print("*"*20)
     print("Data location: " + root)
     print("-"*60)
-    # create a container for the computed results
-    results = []
-    # create a list that stores the Viscdata of each srate
-    visclist = [] 
+    # collect the files of this state point (all shear rates and replicas)
+    paths = []
     for root, subdirs, files in os.walk(root):
         for file in files:
             if (material in file) and (temp in file) and (press in file):
                 abspath = os.path.join(root,file) # absolute path
-                # print(abspath)
                 if os.path.isfile(abspath):
-                    f = loadvisc(abspath,ifplot=False)
-                    srate = float(f.srate)
-                    mean, error = f.average()
-                    results.append([srate,mean,error,error/mean*100])
-                    
-                    visclist.append(f)
+                    paths.append(abspath)
                 else:
                     print("File doesn't exit - " + abspath)
-                # print("-"*60)
-    # results = np.array(results)
+    # load and block-average the files concurrently
+    with ProcessPoolExecutor(nproc) as pool:
+        loaded = list(pool.map(_loadTask,paths))
+    # create a list that stores the Viscdata of each srate (and replica)
+    visclist = [f for f,res in loaded]
+
+    # combine the replicas of each srate by inverse-variance weighting
+    groups = dict()
+    for f,(mean,error) in loaded:
+        groups.setdefault(float(f.srate),[]).append((mean,error))
+    results = []
+    for srate,values in groups.items():
+        means,errors = zip(*values)
+        mean,error,birge,pvalue = combine(means,errors)
+        results.append([srate,mean,error,error/mean*100,
+                        len(values),birge,pvalue])
+        if pvalue < 0.05:
+            print(f"Replicas at {standardsrate(srate)} 1/s are inconsistent "
+                  f"(Birge ratio {birge:.2f}, p = {pvalue:.3f})")
     results = pd.DataFrame(results,
-                           columns=['srate','viscosity','error','rerror%'])
+                           columns=['srate','viscosity','error','rerror%',
+                                    'replicas','birge','p-value'])
     results = results.sort_values('srate')
     
     # sort visclist by srate
-    visclist.sort(key=lambda ff: float(ff.srate) )
+    visclist.sort(key=lambda ff: (float(ff.srate),ff.replica or ''))
     return ViscBatch(visclist,results)
 
 
 
 
+def _fitTask(args):
+    # top-level so that it can be sent to a process pool
+    name,xdata,ydata,yerror = args
+    if name not in rm.MODELS:
+        # registered at runtime in the parent only (spawned workers
+        # re-import rheologymodels); fitted in the parent instead
+        return KeyError
+    try:
+        popt,pcov,stats = rm.fit(name,xdata,ydata,yerror)
+    except (RuntimeError,ValueError) as err:
+        print(f"Fit of {name} failed: {err}")
+        return None
+    return popt,np.sqrt(np.diag(pcov)),stats
+
+
+def fitall(batches,models=None,nproc=None):
+    """
+    fit every model to every ViscBatch in parallel and rank the models
+    batches: list of ViscBatch
+    models: list of model names or functions; all registered models if None
+            Models registered at runtime (rm.register outside of
+            rheologymodels) are unknown to spawned workers (the default
+            on Windows) and are fitted in the calling process instead.
+    return a DataFrame with one row per (state point, model):
+    fitted eta_N and its expanded error, chi2, AIC, BIC and the AIC rank
+    within each state point (1 = best)
+    """
+    if models is None:
+        models = list(rm.MODELS)
+    names = [rm.getmodel(m).__name__ for m in models]
+    tasks = []
+    keys = []
+    for vba in batches:
+        xdata = vba.results['srate'].to_numpy()
+        ydata = vba.results['viscosity'].to_numpy()
+        yerror = vba.results['error'].to_numpy()
+        for name in names:
+            tasks.append((name,xdata,ydata,yerror))
+            keys.append((vba.material,vba.temp,vba.press,name))
+
+    rows = []
+    with ProcessPoolExecutor(nproc) as pool:
+        for key,task,res in zip(keys,tasks,
+                                pool.map(_fitTask,tasks,chunksize=8)):
+            if res is KeyError:
+                res = _fitTask(task)
+            if res is None:
+                continue
+            popt,perr,stats = res
+            params = rm.getmodel(key[3]).params
+            i = params.index('eta_N')
+            rows.append([*key,popt[i],2*perr[i],
+                         stats['chi2'],stats['aic'],stats['bic'],
+                         dict(zip(params,popt))])
+
+    table = pd.DataFrame(rows,columns=['material','temp','press','model',
+                                       'eta_N','error','chi2','aic','bic',
+                                       'params'])
+    table['rank'] = table.groupby(['material','temp','press'])['aic'] \
+                         .rank(method='first').astype(int)
+    table = table.sort_values(['material','temp','press','rank'])
+    return table.reset_index(drop=True)
+
+
+def velprofile(filename,srate,ly,tol=0.1,r2min=0.9,ifplot=False):
+    """
+    check the streaming velocity profile of an NEMD run frame by frame
+    filename: ave/chunk output of vx in bin/1d y (units reduced)
+    srate: imposed shear rate [1/s]
+    ly: box length in y [A]
+    A weighted (by Ncount) least-squares line vx(y) is fitted for every
+    frame at once. A frame is flagged when its slope deviates from the
+    imposed one by more than tol (relative) or when R^2 < r2min.
+    return a DataFrame, one row per frame
+    """
+    steps, data, names = lmp.loadchunk(filename)
+    y = data[:,:,names.index('Coord1')]
+    v = data[:,:,names.index('vx')]
+    w = data[:,:,names.index('Ncount')]
+    # expected slope in A/fs per reduced unit of y
+    expected = float(srate)*1e-15*ly
+
+    wsum = w.sum(axis=1,keepdims=True)
+    ym = (w*y).sum(axis=1,keepdims=True)/wsum
+    vm = (w*v).sum(axis=1,keepdims=True)/wsum
+    sxy = (w*(y-ym)*(v-vm)).sum(axis=1)
+    sxx = (w*(y-ym)**2).sum(axis=1)
+    syy = (w*(v-vm)**2).sum(axis=1)
+    slope = sxy/sxx
+    r2 = sxy**2/(sxx*syy)
+    deviation = slope/expected - 1
+
+    table = pd.DataFrame({'step': steps,
+                          'slope': slope,
+                          'deviation': deviation,
+                          'r2': r2})
+    table['flag'] = (np.abs(deviation) > tol) | (r2 < r2min)
+    print("{} of {} frames deviate from the imposed linear profile"
+          .format(table['flag'].sum(),len(table)))
+    if ifplot:
+        fig, ax = plt.subplots(1,2,figsize=(10,4),constrained_layout=True)
+        fig.suptitle(f'Velocity profile, shear rate = {float(srate):.0e} 1/s')
+        ax[0].plot(y.mean(axis=0),v.mean(axis=0),'o',label='time average')
+        vbar = v.mean()
+        ax[0].plot([0,1],[vbar-expected/2,vbar+expected/2],'--',c='k',
+                   label='imposed')
+        ax[0].set_xlabel('y [-]')
+        ax[0].set_ylabel('vx [A/fs]')
+        ax[0].legend()
+        ax[1].plot(steps,deviation,marker='+')
+        ax[1].axhspan(-tol,tol,color='g',alpha=0.1)
+        ax[1].set_xlabel('step')
+        ax[1].set_ylabel('relative slope deviation')
+        plt.show()
+    return table
+
+
 def standardsrate(srate):
     """
     convert different formats of shear rate to a standard format: